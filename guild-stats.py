@@ -14,60 +14,61 @@ ADDITIONS:
 import json
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from typing import Dict, List, Optional
 import concurrent.futures
 from collections import defaultdict
+from itertools import takewhile
 import sqlite3
 import sys
 import math
+import threading
 
 class GuildStatsDatabase:
+    """SQLite storage. The save_* helpers don't commit; callers scope them with `with db.conn:`."""
     def __init__(self, db_path: str = "docs/guild-stats.db"):
         self.db_path = db_path
         self.conn = None
+        # One entry per active `with` block: True if that block opened the connection
+        self._context_opened = []
         
     def connect(self):
+        if self.conn:
+            return self.conn
         self.conn = sqlite3.connect(self.db_path)
         self.conn.row_factory = sqlite3.Row
         self.conn.execute("PRAGMA foreign_keys = ON")
         self.conn.execute("PRAGMA journal_mode = WAL")
         self.conn.execute("PRAGMA synchronous = NORMAL")
-        self._create_tables_if_not_exist()
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.conn.execute("PRAGMA cache_size = -64000")
+        self.conn.execute("PRAGMA mmap_size = 268435456")
+        
+        self._create_tables()
+        self._create_indexes()
         return self.conn
         
     def disconnect(self):
         if self.conn:
             self.conn.close()
+            self.conn = None
             
     def __enter__(self):
+        # Nested blocks reuse an already open connection and leave it open on exit
+        self._context_opened.append(self.conn is None)
         self.connect()
         return self
         
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.disconnect()
+        if self._context_opened.pop():
+            self.disconnect()
 
-    def _create_tables_if_not_exist(self):
+    def _create_tables(self):
         """Create tables if they don't exist."""
-        schema_sql = """
-        CREATE TABLE IF NOT EXISTS guild_snapshots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            guild_name TEXT NOT NULL,
-            guild_id INTEGER,
-            guild_level INTEGER DEFAULT 0,
-            nexus_level INTEGER NOT NULL,
-            study_level INTEGER NOT NULL,
-            total_upgrades INTEGER DEFAULT 0,
-            nexus_progress INTEGER DEFAULT 0,
-            study_progress INTEGER DEFAULT 0,
-            codex_cost INTEGER DEFAULT 0,
-            baseline_date TEXT,
-            data_fresh BOOLEAN DEFAULT 1,
-            UNIQUE(timestamp, guild_name)
-        );
-
+        schema_sql = self._guild_snapshots_table_sql("guild_snapshots") + """
         CREATE TABLE IF NOT EXISTS daily_baselines (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             date TEXT NOT NULL,
@@ -121,16 +122,95 @@ class GuildStatsDatabase:
             UNIQUE(date, player_name)
         );
 
-        CREATE INDEX IF NOT EXISTS idx_player_dust_income_date ON player_dust_income(date);
-        CREATE INDEX IF NOT EXISTS idx_player_dust_income_player ON player_dust_income(player_name);
-        CREATE INDEX IF NOT EXISTS idx_guild_snapshots_timestamp ON guild_snapshots(timestamp);
-        CREATE INDEX IF NOT EXISTS idx_guild_snapshots_guild_name ON guild_snapshots(guild_name);
-        CREATE INDEX IF NOT EXISTS idx_market_timestamp ON market_prices(timestamp);
-        CREATE INDEX IF NOT EXISTS idx_market_item_name ON market_prices(item_name);
+        CREATE TABLE IF NOT EXISTS mv_top_velocity_guilds (
+            rank INTEGER PRIMARY KEY,
+            guild_name TEXT NOT NULL,
+            nexus_growth INTEGER,
+            study_growth INTEGER,
+            nexus_velocity REAL,
+            study_velocity REAL,
+            total_velocity REAL,
+            data_points INTEGER,
+            hours_tracked REAL,
+            refreshed_at TEXT NOT NULL
+        );
         """
         
         self.conn.executescript(schema_sql)
         self.conn.commit()
+        self._rebuild_legacy_guild_snapshots()
+
+    @staticmethod
+    def _guild_snapshots_table_sql(table_name: str) -> str:
+        # Rows are clustered on (timestamp, guild_name); no rowid or AUTOINCREMENT bookkeeping
+        return f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            timestamp TEXT NOT NULL,
+            guild_name TEXT NOT NULL,
+            guild_id INTEGER,
+            guild_level INTEGER DEFAULT 0,
+            nexus_level INTEGER NOT NULL,
+            study_level INTEGER NOT NULL,
+            total_upgrades INTEGER DEFAULT 0,
+            nexus_progress INTEGER DEFAULT 0,
+            study_progress INTEGER DEFAULT 0,
+            codex_cost INTEGER DEFAULT 0,
+            PRIMARY KEY (timestamp, guild_name)
+        ) WITHOUT ROWID, STRICT;
+        """
+
+    def _rebuild_legacy_guild_snapshots(self):
+        """One-time copy of an old rowid guild_snapshots table into the WITHOUT ROWID, STRICT layout.
+
+        The copy keeps only the current columns, which also drops the unused
+        baseline_date and data_fresh columns from older databases.
+        """
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(guild_snapshots)")}
+        if 'id' not in columns:
+            return
+        
+        print("Rebuilding guild_snapshots as a WITHOUT ROWID table...")
+        kept_columns = ("timestamp, guild_name, guild_id, guild_level, nexus_level, study_level, "
+                        "total_upgrades, nexus_progress, study_progress, codex_cost")
+        # Legacy rename semantics let views on guild_snapshots survive the drop-and-rename
+        self.conn.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            with self.conn:
+                self.conn.execute("DROP TABLE IF EXISTS guild_snapshots_rebuild")
+                self.conn.execute(self._guild_snapshots_table_sql("guild_snapshots_rebuild"))
+                self.conn.execute(f"""
+                    INSERT INTO guild_snapshots_rebuild ({kept_columns})
+                    SELECT {kept_columns} FROM guild_snapshots
+                """)
+                self.conn.execute("DROP TABLE guild_snapshots")
+                self.conn.execute("ALTER TABLE guild_snapshots_rebuild RENAME TO guild_snapshots")
+        finally:
+            self.conn.execute("PRAGMA legacy_alter_table = OFF")
+        # Reclaim the old table's pages; the .db file is what the dashboard downloads
+        self.conn.execute("VACUUM")
+
+    def _create_indexes(self):
+        """Create secondary indexes if they don't exist."""
+        index_sql = """
+        CREATE INDEX IF NOT EXISTS idx_player_dust_income_player ON player_dust_income(player_name);
+        CREATE INDEX IF NOT EXISTS idx_guild_snapshots_guild_timestamp ON guild_snapshots(guild_name, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_market_item_timestamp ON market_prices(item_name, timestamp);
+
+        -- Covered by the (name, timestamp) composite indexes above
+        DROP INDEX IF EXISTS idx_guild_snapshots_guild_name;
+        DROP INDEX IF EXISTS idx_market_item_name;
+        -- Same columns as idx_market_item_timestamp; UNIQUE(timestamp, item_name) already enforces uniqueness
+        DROP INDEX IF EXISTS idx_market_prices_unique;
+        -- Covered by the (timestamp, guild_name) primary key and UNIQUE(timestamp, item_name)
+        DROP INDEX IF EXISTS idx_guild_snapshots_timestamp;
+        DROP INDEX IF EXISTS idx_market_timestamp;
+        -- Covered by the UNIQUE(date, ...) constraint indexes
+        DROP INDEX IF EXISTS idx_player_dust_income_date;
+        DROP INDEX IF EXISTS idx_baselines_date;
+        """
+        
+        self.conn.executescript(index_sql)
+        self.conn.commit()
 
     def calculate_mana_dust_income(self, player_data: Dict) -> float:
         """
@@ -174,24 +254,31 @@ class GuildStatsDatabase:
             print(f"Error calculating dust for player {player_data.get('Name', 'N/A')}: {e}")
             return 0.0
 
-    def save_guild_snapshot(self, guilds: List[Dict], timestamp: str, baseline_date: str, data_fresh: bool = True) -> int:
+    def save_guild_snapshot(self, guilds: List[Dict], timestamp: str) -> int:
         records = []
         for guild in guilds:
             records.append((
                 timestamp, guild['GuildName'], guild.get('GuildID'),
                 guild.get('GuildLevel', 0), guild['NexusLevel'], guild['StudyLevel'], 
                 guild.get('TotalUpgrades', 0), guild.get('NexusProgress', 0),
-                guild.get('StudyProgress', 0), guild.get('TotalCodexCost', 0),
-                baseline_date, data_fresh
+                guild.get('StudyProgress', 0), guild.get('TotalCodexCost', 0)
             ))
         
         self.conn.executemany("""
-            INSERT OR REPLACE INTO guild_snapshots 
+            INSERT INTO guild_snapshots 
             (timestamp, guild_name, guild_id, guild_level, nexus_level, study_level,
-             total_upgrades, nexus_progress, study_progress, codex_cost, baseline_date, data_fresh)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             total_upgrades, nexus_progress, study_progress, codex_cost)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(timestamp, guild_name) DO UPDATE SET
+                guild_id = excluded.guild_id,
+                guild_level = excluded.guild_level,
+                nexus_level = excluded.nexus_level,
+                study_level = excluded.study_level,
+                total_upgrades = excluded.total_upgrades,
+                nexus_progress = excluded.nexus_progress,
+                study_progress = excluded.study_progress,
+                codex_cost = excluded.codex_cost
         """, records)
-        self.conn.commit()
         return len(records)
 
     def get_daily_baseline(self, date: str = None) -> Dict:
@@ -215,71 +302,96 @@ class GuildStatsDatabase:
         
         return {'date': date, 'created_at': created_at, 'guilds': guilds}
 
-    def create_daily_baseline(self, guilds: List[Dict], date: str = None) -> str:
+    def create_daily_baseline(self, guilds: List[Dict], date: str = None, timestamp: str = None) -> str:
         if not date:
             date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if not timestamp:
+            timestamp = datetime.now(timezone.utc).isoformat()
         
-        timestamp = datetime.now(timezone.utc).isoformat()
         records = [(date, g['GuildName'], g['NexusLevel'], g['StudyLevel'], timestamp) for g in guilds]
         
         self.conn.executemany("""
-            INSERT OR REPLACE INTO daily_baselines 
+            INSERT INTO daily_baselines 
             (date, guild_name, nexus_level, study_level, created_at)
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(date, guild_name) DO UPDATE SET
+                nexus_level = excluded.nexus_level,
+                study_level = excluded.study_level,
+                created_at = excluded.created_at
         """, records)
-        self.conn.commit()
         return timestamp
 
-    def is_new_day_baseline_needed(self) -> bool:
-        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        cursor = self.conn.execute("SELECT COUNT(*) as count FROM daily_baselines WHERE date = ?", [today])
-        return cursor.fetchone()['count'] == 0
+    def is_new_day_baseline_needed(self, date: str = None) -> bool:
+        if not date:
+            date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        cursor = self.conn.execute("SELECT 1 FROM daily_baselines WHERE date = ? LIMIT 1", [date])
+        return cursor.fetchone() is None
 
     def save_market_prices(self, prices: Dict, timestamp: str) -> int:
         records = [(timestamp, item_name, None, price_data['buy'], price_data['sell']) 
                   for item_name, price_data in prices.items()]
         
         self.conn.executemany("""
-            INSERT OR REPLACE INTO market_prices 
+            INSERT INTO market_prices 
             (timestamp, item_name, item_id, buy_price, sell_price)
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(timestamp, item_name) DO UPDATE SET
+                item_id = excluded.item_id,
+                buy_price = excluded.buy_price,
+                sell_price = excluded.sell_price
         """, records)
-        self.conn.commit()
         return len(records)
 
-    def save_player_dust_income(self, date: str, records: List[Dict]) -> int:
+    def save_player_dust_income(self, date: str, records: List[Dict], timestamp: str = None) -> int:
         """
         Save (or replace) player dust income rows for a given date.
         records: list of dicts {player_name, rank, daily_income}
         """
-        timestamp = datetime.now(timezone.utc).isoformat()
+        if not timestamp:
+            timestamp = datetime.now(timezone.utc).isoformat()
         rows = []
         for r in records:
             rows.append((date, timestamp, r['player_name'], r.get('rank'), r['daily_income']))
         self.conn.executemany("""
-            INSERT OR REPLACE INTO player_dust_income
+            INSERT INTO player_dust_income
             (date, timestamp, player_name, leaderboard_rank, daily_income)
             VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(date, player_name) DO UPDATE SET
+                timestamp = excluded.timestamp,
+                leaderboard_rank = excluded.leaderboard_rank,
+                daily_income = excluded.daily_income
         """, rows)
-        self.conn.commit()
         return len(rows)
 
+    def save_processing_log(self, timestamp: str, execution_time: float, guilds_processed: int,
+                            api_calls_made: int, data_freshness: Dict, errors: List[str],
+                            baseline_created: bool):
+        """Record one run in processing_logs; committed by the caller's transaction."""
+        self.conn.execute("""
+            INSERT INTO processing_logs 
+            (timestamp, execution_time_seconds, guilds_processed, api_calls_made, data_freshness, errors, baseline_created)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            timestamp, execution_time, guilds_processed, api_calls_made,
+            json.dumps(data_freshness),
+            "; ".join(errors) if errors else None,
+            baseline_created
+        ])
+
     def calculate_average_codex_price(self, hours: int = 24) -> float:
-        cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+        # Cutoff is formatted like the stored isoformat() timestamps so text comparison stays valid
         cursor = self.conn.execute("""
-            SELECT average_price FROM market_prices 
-            WHERE item_name = 'Codex' AND timestamp >= ?
-            ORDER BY timestamp DESC
-        """, [cutoff])
+            SELECT AVG(average_price) as avg_price, COUNT(*) as count FROM market_prices 
+            WHERE item_name = 'Codex' AND timestamp >= strftime('%Y-%m-%dT%H:%M:%f', 'now', ?)
+        """, [f"-{hours} hours"])
         
-        prices = [row['average_price'] for row in cursor.fetchall()]
-        return sum(prices) / len(prices) if prices else 10000000000
+        row = cursor.fetchone()
+        return row['avg_price'] if row['count'] else 10000000000
 
     def format_currency(self, amount: float) -> str:
-        if amount >= 1e12: return f"{amount / 1e12:.2f}T"
-        if amount >= 1e9: return f"{amount / 1e9:.2f}B"
-        if amount >= 1e6: return f"{amount / 1e6:.2f}M"
-        if amount >= 1e3: return f"{amount / 1e3:.2f}K"
+        for threshold, suffix in CURRENCY_TIERS:
+            if amount >= threshold:
+                return f"{amount / threshold:.2f}{suffix}"
         return f"{amount:.2f}"
 
 # --- Configuration (Updated) ---
@@ -289,6 +401,7 @@ API_DELAY = 2
 BASE_PER_UPGRADE = 0.02
 DATA_DIR = "docs"
 MAX_GUILDS = 30
+CURRENCY_TIERS = ((1e12, "T"), (1e9, "B"), (1e6, "M"), (1e3, "K"))
 
 # Item mapping (unchanged)
 ITEM_MAPPING = {
@@ -311,27 +424,81 @@ ITEM_MAPPING = {
 
 UNTRADEABLE_IDS = {38, 42, 43, 48, 49}
 
+# (API item key, item name) pairs for market parsing; the market payload is keyed by string IDs
+TRADEABLE_ITEMS = tuple(
+    (str(item_id), item_name) for item_id, item_name in ITEM_MAPPING.items()
+    if item_id not in UNTRADEABLE_IDS
+)
+
+# Damage boost IDs checked (in order) when deriving the guild Nexus level
+BOOST_PRIORITY = tuple(str(boost_id) for boost_id in (30, 31, 32, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50))
+EQUIPMENT_SLOTS = tuple(str(slot) for slot in range(1, 9))
+
+class LinearRetry(Retry):
+    """urllib3 Retry that backs off 5s, 10s, ... like the tracker always has, and logs each failed attempt.
+
+    Retries skip the API token bucket, so the backoff is what keeps them off the rate limit.
+    """
+    def __init__(self, *args, base_url: str = "", **kwargs):
+        super().__init__(*args, **kwargs)
+        # urllib3 only passes the request path, so keep the API base for log lines
+        self.base_url = base_url
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.base_url = self.base_url
+        return retry
+
+    def get_backoff_time(self) -> float:
+        consecutive_errors = len(list(takewhile(lambda h: h.redirect_location is None, reversed(self.history))))
+        return self.backoff_factor * consecutive_errors
+
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        retry = super().increment(method, url, response, error, *args, **kwargs)
+        reason = error or f"HTTP {response.status}"
+        print(f"API Error on {self.base_url}{url} (attempt {len(retry.history)}), retrying in {retry.get_backoff_time():.0f}s: {reason}")
+        return retry
+
 class APIClient:
     """API client for Manarion API calls."""
     def __init__(self, base_url: str):
         self.base_url = base_url
         self.session = requests.Session()
         self.session.headers.update({'User-Agent': 'GuildStatsTracker/4.0-SQLite-Pure'})
+        # One keep-alive connection per worker; urllib3 retries failed calls on the same pool
+        retry = LinearRetry(total=2, backoff_factor=5, status_forcelist=(429, 500, 502, 503, 504), base_url=base_url)
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=retry))
+        # Shared across worker threads: at most MAX_WORKERS requests in flight, drawing from a
+        # token bucket that holds MAX_WORKERS tokens and refills at MAX_WORKERS per API_DELAY
+        self._in_flight = threading.Semaphore(MAX_WORKERS)
+        self._rate_lock = threading.Lock()
+        self._tokens = float(MAX_WORKERS)
+        self._last_refill = time.monotonic()
 
-    def get(self, endpoint: str, params: Optional[Dict] = None, retries: int = 3) -> Optional[Dict]:
+    def _wait_for_request_slot(self):
+        """Take a request token, sleeping only until one is available."""
+        with self._rate_lock:
+            now = time.monotonic()
+            refill_rate = MAX_WORKERS / API_DELAY
+            self._tokens = min(MAX_WORKERS, self._tokens + (now - self._last_refill) * refill_rate)
+            self._last_refill = now
+            # Going negative reserves the next token for this caller
+            self._tokens -= 1
+            delay = -self._tokens / refill_rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+    def get(self, endpoint: str, params: Optional[Dict] = None) -> Optional[Dict]:
         url = f"{self.base_url}{endpoint}"
-        for attempt in range(retries):
-            try:
-                time.sleep(API_DELAY)
+        try:
+            with self._in_flight:
+                self._wait_for_request_slot()
                 response = self.session.get(url, params=params, timeout=30)
-                response.raise_for_status()
-                return response.json()
-            except requests.RequestException as e:
-                print(f"API Error on {url} (attempt {attempt + 1}/{retries}): {e}")
-                if attempt < retries - 1:
-                    time.sleep(5 * (attempt + 1))
-                else:
-                    return None
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            print(f"API Error on {url}: {e}")
+            return None
 
 class GuildStatsTracker:
     def __init__(self, db_path: str = "docs/guild-stats.db"):
@@ -373,29 +540,35 @@ class GuildStatsTracker:
         players_processed = 0
         players_skipped = 0
         
-        for i, guild_info in enumerate(top_guilds):
-            guild_name = guild_info["Name"]
-            owner_id = guild_info["OwnerID"]
-            
-            print(f"  Processing guild {i+1}/{len(top_guilds)}: {guild_name}")
-            
-            player_data = self.api.get(f"/players/{owner_id}")
-            
-            if not player_data:
-                print(f"    Failed to fetch owner data for {guild_name}")
-                players_skipped += 1
-                continue
-            
-            result = self.process_guild_owner_data(guild_name, player_data, guild_info["TotalUpgrades"])
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            owner_futures = [
+                executor.submit(self.api.get, f"/players/{guild_info['OwnerID']}")
+                for guild_info in top_guilds
+            ]
             
-            if result:
-                result["GuildLevel"] = guild_info["Level"]
-                result["GuildID"] = guild_info["ID"]
-                guild_data.append(result)
-                players_processed += 1
-                print(f"    {guild_name} -> Nexus: L{result['NexusLevel']}, Study: L{result['StudyLevel']}")
-            else:
-                players_skipped += 1
+            # Consume in submission order so output and snapshot order stay stable
+            for i, (guild_info, future) in enumerate(zip(top_guilds, owner_futures)):
+                guild_name = guild_info["Name"]
+                
+                print(f"  Processing guild {i+1}/{len(top_guilds)}: {guild_name}")
+                
+                player_data = future.result()
+                
+                if not player_data:
+                    print(f"    Failed to fetch owner data for {guild_name}")
+                    players_skipped += 1
+                    continue
+                
+                result = self.process_guild_owner_data(guild_name, player_data, guild_info["TotalUpgrades"])
+                
+                if result:
+                    result["GuildLevel"] = guild_info["Level"]
+                    result["GuildID"] = guild_info["ID"]
+                    guild_data.append(result)
+                    players_processed += 1
+                    print(f"    {guild_name} -> Nexus: L{result['NexusLevel']}, Study: L{result['StudyLevel']}")
+                else:
+                    players_skipped += 1
         
         print(f"\nProcessing Summary:")
         print(f"   Guild owners processed: {players_processed}")
@@ -414,44 +587,55 @@ class GuildStatsTracker:
             total_exp_boost = total_boosts.get("100", 0)
             spire_boost = base_boosts.get("152", 0)
 
-            boost_priority = [30, 31, 32, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50]
+            spire_factor = 1 + spire_boost/100
+            equipments = player_data.get("Equipment", {})
+            
+            # Infusions don't depend on the boost being checked, so resolve each slot once
+            equipment_boosts = []
+            for item_key in EQUIPMENT_SLOTS:
+                try:
+                    equipment_item = equipments.get(item_key, {})
+                    
+                    infusions = equipment_item.get("Infusions", {})
+                    if isinstance(infusions, dict):
+                        # Infusion counts are numeric in practice; only filter when a stray value breaks sum()
+                        try:
+                            infusions_count = sum(infusions.values())
+                        except TypeError:
+                            infusions_count = sum(v for v in infusions.values() if isinstance(v, (int, float)))
+                    else:
+                        infusions_count = infusions if isinstance(infusions, (int, float)) else 0
+                    
+                    # The boost sum below runs outside this try, so malformed boosts are dropped here:
+                    # a non-dict skips the slot, a non-numeric value skips that boost
+                    boosts = equipment_item.get("Boosts", {})
+                    if not isinstance(boosts, dict):
+                        raise TypeError(f"Boosts is {type(boosts).__name__}, not dict")
+                    boosts = {k: v for k, v in boosts.items() if isinstance(v, (int, float))}
+
+                    equipment_boosts.append((boosts, 1 + 0.05 * infusions_count))
+                    
+                except Exception as e:
+                    print(f"      Error processing equipment item {item_key}: {e}")
+                    continue
 
             base_damage_percent = 0
             owner_upgrades = 0
 
-            for boost_id in boost_priority:
-                boost_id_str = str(boost_id)
+            for boost_id_str in BOOST_PRIORITY:
                 owner_upgrades = base_boosts.get(boost_id_str, 0)
                 total_boost_percent = total_boosts.get(boost_id_str, 0) * 100
                 
-                equipments = player_data.get("Equipment", {})
-                totalEquipmentBoosts = 0
-                
-                for item in range(1, 9):
-                    try:
-                        item_key = str(item)
-                        equipment_item = equipments.get(item_key, {})
-                        
-                        infusions = equipment_item.get("Infusions", {})
-                        if isinstance(infusions, dict):
-                            infusions_count = sum(v for v in infusions.values() if isinstance(v, (int, float)))
-                        else:
-                            infusions_count = infusions if isinstance(infusions, (int, float)) else 0
-                        
-                        base_boost = equipment_item.get("Boosts", {}).get(boost_id_str, 0)
-                        equip_percent = (base_boost * (1 + 0.05 * infusions_count) * (1 + spire_boost/100)) / 50
-                        totalEquipmentBoosts += equip_percent
-                        
-                    except Exception as e:
-                        print(f"      Error processing equipment item {item}: {e}")
-                        continue
+                totalEquipmentBoosts = sum(
+                    boosts.get(boost_id_str, 0) * infusion_factor * spire_factor / 50
+                    for boosts, infusion_factor in equipment_boosts
+                )
                 
                 base_damage_percent = total_boost_percent - totalEquipmentBoosts - 100
                 
                 if base_damage_percent > 0:
                     break
 
-            equipments = player_data.get("Equipment", {})
             enchant_boost = 0
             item_5 = equipments.get("5", {})
             if item_5:
@@ -486,11 +670,16 @@ class GuildStatsTracker:
     def calculate_codex_cost(self, start_level: int, progress: int) -> int:
         if progress <= 0: 
             return 0
-        return sum(range(start_level + 1, start_level + progress + 1))
+        # Sum of levels start_level+1 .. start_level+progress
+        return progress * (2 * start_level + progress + 1) // 2
 
-    def fetch_market_prices(self) -> tuple[Dict, bool]:
+    def fetch_market_prices(self, market_future: Optional[concurrent.futures.Future] = None) -> tuple[Dict, bool]:
+        """Parse /market prices, optionally from a request already started by the caller.
+
+        The database fallback stays on the calling thread, which owns the SQLite connection.
+        """
         print("Fetching market prices...")
-        market_data = self.api.get("/market")
+        market_data = market_future.result() if market_future else self.api.get("/market")
         
         if not market_data:
             print("Market API failed, using database cache...")
@@ -499,10 +688,8 @@ class GuildStatsTracker:
 
         prices = {}
         buy_data, sell_data = market_data.get("Buy", {}), market_data.get("Sell", {})
-        for item_id, item_name in ITEM_MAPPING.items():
-            if item_id in UNTRADEABLE_IDS: 
-                continue
-            buy_price, sell_price = buy_data.get(str(item_id)), sell_data.get(str(item_id))
+        for item_key, item_name in TRADEABLE_ITEMS:
+            buy_price, sell_price = buy_data.get(item_key), sell_data.get(item_key)
             if buy_price and sell_price:
                 prices[item_name] = {"buy": buy_price, "sell": sell_price}
         
@@ -537,15 +724,16 @@ class GuildStatsTracker:
             print(f"  - Error computing dust for {player_name}: {e}")
             return None
 
-    def fetch_leaderboard_and_store_daily_dust(self, force: bool = False):
+    def fetch_leaderboard_and_store_daily_dust(self, force: bool = False, today_str: str = None, timestamp: str = None):
         """
         Fetches top 100 battle leaderboard, calculates daily dust income, and stores it.
         This function is designed to run only once per UTC day unless forced.
         """
-        today_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if not today_str:
+            today_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
         
-        cursor = self.db.conn.execute("SELECT COUNT(*) as count FROM player_dust_income WHERE date = ?", [today_str])
-        if cursor.fetchone()['count'] > 0 and not force:
+        cursor = self.db.conn.execute("SELECT 1 FROM player_dust_income WHERE date = ? LIMIT 1", [today_str])
+        if cursor.fetchone() is not None and not force:
             print(f"Daily dust income for {today_str} already exists. Skipping.")
             return
 
@@ -580,14 +768,17 @@ class GuildStatsTracker:
                     print(f"  - Generated an exception for {player_name}: {exc}")
         
         if income_results:
-            self.db.save_player_dust_income(today_str, income_results)
+            with self.db.conn:
+                self.db.save_player_dust_income(today_str, income_results, timestamp)
             print(f"Successfully saved daily dust income for {len(income_results)} players.")
 
     def run_update(self):
         """Main execution method using SQLite database."""
         start_time = time.time()
-        timestamp = datetime.now(timezone.utc).isoformat()
-        today_str = timestamp.split('T')[0]
+        # One clock reading per run so every write and date check agrees, even across UTC midnight
+        run_ts = datetime.now(timezone.utc)
+        timestamp = run_ts.isoformat()
+        today_str = run_ts.strftime("%Y-%m-%d")
         
         print(f"Starting SQLite guild tracking at {timestamp}")
         
@@ -596,61 +787,66 @@ class GuildStatsTracker:
 
         self.db.connect()
         try:
-            current_guilds, guild_data_fresh = self.fetch_guild_data()
-            market_prices, market_data_fresh = self.fetch_market_prices()
+            # /market is independent of the guild owners, so request it while they are fetched
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                market_future = executor.submit(self.api.get, "/market")
+                current_guilds, guild_data_fresh = self.fetch_guild_data()
+                market_prices, market_data_fresh = self.fetch_market_prices(market_future)
             
             if not current_guilds:
                 errors.append("No fresh guild data available")
             
-            if self.db.is_new_day_baseline_needed() and current_guilds:
-                print(f"New day detected. Creating baseline for {today_str}")
-                self.db.create_daily_baseline(current_guilds, today_str)
-                baseline_created = True
-                print(f"Baseline created for {len(current_guilds)} guilds")
-            
-            baseline = self.db.get_daily_baseline(today_str)
-            baseline_date = baseline.get('date')
-            
-            for guild in current_guilds:
-                base = baseline.get("guilds", {}).get(guild["GuildName"])
-                if base:
-                    nexus_progress = max(0, guild["NexusLevel"] - base["NexusLevel"])
-                    study_progress = max(0, guild["StudyLevel"] - base["StudyLevel"])
-                    
-                    guild["NexusProgress"] = nexus_progress
-                    guild["StudyProgress"] = study_progress
-                    guild["TotalCodexCost"] = (
-                        self.calculate_codex_cost(base["NexusLevel"], nexus_progress) +
-                        self.calculate_codex_cost(base["StudyLevel"], study_progress)
-                    )
-                else:
-                    guild["NexusProgress"] = guild["StudyProgress"] = guild["TotalCodexCost"] = 0
+            # All writes for this run share one transaction (committed or rolled back together)
+            with self.db.conn:
+                if self.db.is_new_day_baseline_needed(today_str) and current_guilds:
+                    print(f"New day detected. Creating baseline for {today_str}")
+                    self.db.create_daily_baseline(current_guilds, today_str, timestamp)
+                    baseline_created = True
+                    print(f"Baseline created for {len(current_guilds)} guilds")
+                
+                baseline_guilds = self.db.get_daily_baseline(today_str).get("guilds") or {}
+                
+                for guild in current_guilds:
+                    base = baseline_guilds.get(guild["GuildName"])
+                    if base:
+                        nexus_progress = max(0, guild["NexusLevel"] - base["NexusLevel"])
+                        study_progress = max(0, guild["StudyLevel"] - base["StudyLevel"])
+                        
+                        guild["NexusProgress"] = nexus_progress
+                        guild["StudyProgress"] = study_progress
+                        guild["TotalCodexCost"] = (
+                            self.calculate_codex_cost(base["NexusLevel"], nexus_progress) +
+                            self.calculate_codex_cost(base["StudyLevel"], study_progress)
+                        )
+                    else:
+                        guild["NexusProgress"] = guild["StudyProgress"] = guild["TotalCodexCost"] = 0
+                
+                if current_guilds:
+                    self.db.save_guild_snapshot(current_guilds, timestamp)
+                
+                if market_prices and market_data_fresh:
+                    self.db.save_market_prices(market_prices, timestamp)
+                
+                if current_guilds:
+                    self.update_guild_metadata(current_guilds, timestamp)
+                    self.refresh_top_velocity_guilds(timestamp)
+
+                execution_time = time.time() - start_time
+                self.db.save_processing_log(
+                    timestamp, execution_time, len(current_guilds), MAX_GUILDS + 1,
+                    {"guild_data_fresh": guild_data_fresh, "market_data_fresh": market_data_fresh},
+                    errors, baseline_created
+                )
             
-            if current_guilds:
-                self.db.save_guild_snapshot(current_guilds, timestamp, baseline_date, guild_data_fresh)
+            # --- Trigger Daily Player Dust Income Fetch ---
+            # Runs after the commit so its ~100 API calls don't hold up, or roll back, this run's writes
+            self.fetch_leaderboard_and_store_daily_dust(today_str=today_str, timestamp=timestamp)
             
-            if market_prices and market_data_fresh:
-                self.db.save_market_prices(market_prices, timestamp)
+            # Refresh planner statistics for tables that have grown or have unanalyzed indexes
+            self.db.conn.execute("PRAGMA optimize")
             
-            if current_guilds:
-                self.update_guild_metadata(current_guilds, timestamp)
-
-            # --- Trigger Daily Player Dust Income Fetch ---
-            self.fetch_leaderboard_and_store_daily_dust()
-
-            execution_time = time.time() - start_time
-            self.db.conn.execute("""
-                INSERT INTO processing_logs 
-                (timestamp, execution_time_seconds, guilds_processed, api_calls_made, data_freshness, errors, baseline_created)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, [
-                timestamp, execution_time, len(current_guilds), 
-                MAX_GUILDS + 1,
-                json.dumps({"guild_data_fresh": guild_data_fresh, "market_data_fresh": market_data_fresh}),
-                "; ".join(errors) if errors else None, 
-                baseline_created
-            ])
-            self.db.conn.commit()
+            # Fold the WAL back into the database file so the committed .db is complete
+            self.db.conn.execute("PRAGMA wal_checkpoint(RESTART)")
             
             print(f"\n=== SQLite Update Complete in {execution_time:.2f}s ===")
         
@@ -674,12 +870,37 @@ class GuildStatsTracker:
                 guild.get('GuildLevel', 0)
             ))
         
-        self.db.conn.executemany("""
-            INSERT OR REPLACE INTO guilds 
-            (guild_id, guild_name, owner_id, last_seen, is_active, total_upgrades, guild_level)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, guild_records)
-        self.db.conn.commit()
+        # guild_name is UNIQUE too: a name taken over by another guild ID is freed from the old row first,
+        # as INSERT OR REPLACE used to, instead of failing the upsert and the run's transaction
+        for record in guild_records:
+            self.db.conn.execute(
+                "DELETE FROM guilds WHERE guild_name = ? AND guild_id IS NOT ?", (record[1], record[0])
+            )
+            self.db.conn.execute("""
+                INSERT INTO guilds 
+                (guild_id, guild_name, owner_id, last_seen, is_active, total_upgrades, guild_level)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(guild_id) DO UPDATE SET
+                    guild_name = excluded.guild_name,
+                    owner_id = excluded.owner_id,
+                    last_seen = excluded.last_seen,
+                    is_active = excluded.is_active,
+                    total_upgrades = excluded.total_upgrades,
+                    guild_level = excluded.guild_level
+            """, record)
+
+    def refresh_top_velocity_guilds(self, timestamp: str, hours: int = 168):
+        """Store the current velocity ranking so reports don't rescan the snapshot window."""
+        self.db.conn.execute("DELETE FROM mv_top_velocity_guilds")
+        # Filled straight from the velocity query; the rows never pass through Python
+        self.db.conn.execute(f"""
+            INSERT INTO mv_top_velocity_guilds
+            (rank, guild_name, nexus_growth, study_growth, nexus_velocity, study_velocity,
+             total_velocity, data_points, hours_tracked, refreshed_at)
+            SELECT ROW_NUMBER() OVER (ORDER BY total_velocity DESC), guild_name, nexus_growth, study_growth,
+                   nexus_velocity, study_velocity, total_velocity, data_points, hours_tracked, ?
+            FROM ({self._progress_velocity_sql("guild_snapshots")})
+        """, [timestamp, f"-{hours} hours"])
 
     def get_database_stats(self) -> Dict:
         """Get database statistics."""
@@ -695,51 +916,73 @@ class GuildStatsTracker:
             
             return stats
     
-    def get_progress_velocity_report(self, hours: int = 72) -> Dict:
+    @staticmethod
+    def _progress_velocity_sql(source: str) -> str:
+        """Top-20 velocity aggregate over `source`; takes the '-N hours' window as its one parameter."""
+        return f"""
+            WITH guild_velocity AS (
+                SELECT 
+                    guild_name,
+                    MIN(nexus_level) as start_nexus,
+                    MAX(nexus_level) as end_nexus,
+                    MIN(study_level) as start_study,
+                    MAX(study_level) as end_study,
+                    COUNT(*) as data_points,
+                    (julianday(MAX(timestamp)) - julianday(MIN(timestamp))) * 24 as hours_tracked
+                FROM {source}
+                WHERE timestamp >= strftime('%Y-%m-%dT%H:%M:%f', 'now', ?)
+                GROUP BY guild_name
+                HAVING data_points >= 2 AND hours_tracked > 0
+            )
+            SELECT 
+                guild_name,
+                (end_nexus - start_nexus) as nexus_growth,
+                (end_study - start_study) as study_growth,
+                (end_nexus - start_nexus) / hours_tracked as nexus_velocity,
+                (end_study - start_study) / hours_tracked as study_velocity,
+                ((end_nexus - start_nexus) + (end_study - start_study)) / hours_tracked as total_velocity,
+                data_points,
+                hours_tracked
+            FROM guild_velocity
+            ORDER BY total_velocity DESC
+            LIMIT 20
+        """
+
+    def _query_progress_velocity(self, hours: int, source: str = "guild_snapshots") -> List[Dict]:
+        """Run the velocity aggregate against guild_snapshots or a window snapshot of it."""
+        cursor = self.db.conn.execute(self._progress_velocity_sql(source), [f"-{hours} hours"])
+        return list(map(dict, cursor))
+
+    def get_progress_velocity_report(self, hours: int = 72) -> List[Dict]:
         """Generate progress velocity report for all guilds."""
         print(f"Generating progress velocity report for last {hours} hours...")
         
-        cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
-        
         with self.db:
-            cursor = self.db.conn.execute("""
-                WITH guild_velocity AS (
-                    SELECT 
-                        guild_name,
-                        MIN(nexus_level) as start_nexus,
-                        MAX(nexus_level) as end_nexus,
-                        MIN(study_level) as start_study,
-                        MAX(study_level) as end_study,
-                        COUNT(*) as data_points,
-                        (julianday(MAX(timestamp)) - julianday(MIN(timestamp))) * 24 as hours_tracked
-                    FROM guild_snapshots
-                    WHERE timestamp >= ?
-                    GROUP BY guild_name
-                    HAVING data_points >= 2 AND hours_tracked > 0
-                )
-                SELECT 
-                    guild_name,
-                    (end_nexus - start_nexus) as nexus_growth,
-                    (end_study - start_study) as study_growth,
-                    ROUND((end_nexus - start_nexus) / hours_tracked, 4) as nexus_velocity,
-                    ROUND((end_study - start_study) / hours_tracked, 4) as study_velocity,
-                    ROUND(((end_nexus - start_nexus) + (end_study - start_study)) / hours_tracked, 4) as total_velocity,
-                    data_points,
-                    ROUND(hours_tracked, 1) as hours_tracked
-                FROM guild_velocity
-                ORDER BY total_velocity DESC
-                LIMIT 20
-            """, [cutoff])
-            
-            return [dict(row) for row in cursor.fetchall()]
+            return [self._round_velocity_row(row) for row in self._query_progress_velocity(hours)]
+
+    @staticmethod
+    def _round_velocity_row(row: Dict) -> Dict:
+        """Round raw velocity figures for report output; stored values stay unrounded."""
+        for key in ('nexus_velocity', 'study_velocity', 'total_velocity'):
+            row[key] = round(row[key], 4)
+        row['hours_tracked'] = round(row['hours_tracked'], 1)
+        return row
 
     def generate_weekly_report(self) -> Dict:
         """Generate comprehensive weekly progress report."""
         print("Generating weekly progress report...")
         
-        week_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-        
         with self.db:
+            # Materialize the week once; the report queries below read from it
+            self.db.conn.execute("DROP TABLE IF EXISTS temp.window_snap")
+            self.db.conn.execute("""
+                CREATE TEMP TABLE window_snap AS
+                SELECT guild_name, timestamp, nexus_level, study_level,
+                       nexus_progress, study_progress, codex_cost
+                FROM guild_snapshots
+                WHERE timestamp >= strftime('%Y-%m-%dT%H:%M:%f', 'now', '-7 days')
+            """)
+            
             cursor = self.db.conn.execute("""
                 SELECT 
                     COUNT(DISTINCT guild_name) as guilds_tracked,
@@ -748,34 +991,54 @@ class GuildStatsTracker:
                     SUM(codex_cost) as total_codex_used,
                     AVG(nexus_level) as avg_nexus_level,
                     AVG(study_level) as avg_study_level
-                FROM guild_snapshots
-                WHERE timestamp >= ?
-            """, [week_ago])
+                FROM window_snap
+            """)
             
             weekly_totals = dict(cursor.fetchone())
             
-            velocity_report = self.get_progress_velocity_report(hours=168)
+            # Velocity ranking is refreshed by run_update; only recompute if it was never stored
+            cursor = self.db.conn.execute("""
+                SELECT guild_name, nexus_growth, study_growth, nexus_velocity, study_velocity,
+                       total_velocity, data_points, hours_tracked
+                FROM mv_top_velocity_guilds
+                ORDER BY rank
+                LIMIT 10
+            """)
+            velocity_report = list(map(dict, cursor))
+            if not velocity_report:
+                velocity_report = self._query_progress_velocity(168, source="window_snap")
             
+            # Build the breakdown as a JSON array inside SQLite so Python only decodes once
             cursor = self.db.conn.execute("""
-                SELECT 
-                    DATE(timestamp) as date,
-                    COUNT(DISTINCT guild_name) as guilds,
-                    SUM(nexus_progress) as nexus_progress,
-                    SUM(study_progress) as study_progress,
-                    SUM(codex_cost) as codex_used
-                FROM guild_snapshots
-                WHERE timestamp >= ?
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-            """, [week_ago])
+                SELECT json_group_array(json_object(
+                    'date', date,
+                    'guilds', guilds,
+                    'nexus_progress', nexus_progress,
+                    'study_progress', study_progress,
+                    'codex_used', codex_used
+                )) as breakdown
+                FROM (
+                    SELECT 
+                        DATE(timestamp) as date,
+                        COUNT(DISTINCT guild_name) as guilds,
+                        SUM(nexus_progress) as nexus_progress,
+                        SUM(study_progress) as study_progress,
+                        SUM(codex_cost) as codex_used
+                    FROM window_snap
+                    GROUP BY DATE(timestamp)
+                    ORDER BY date DESC
+                )
+            """)
+            
+            daily_breakdown = json.loads(cursor.fetchone()['breakdown'])
             
-            daily_breakdown = [dict(row) for row in cursor.fetchall()]
+            self.db.conn.execute("DROP TABLE temp.window_snap")
             
             return {
                 "report_period": "7 days",
                 "generated_at": datetime.now(timezone.utc).isoformat(),
                 "weekly_totals": weekly_totals,
-                "top_velocity_guilds": velocity_report[:10],
+                "top_velocity_guilds": [self._round_velocity_row(row) for row in velocity_report[:10]],
                 "daily_breakdown": daily_breakdown
             }
 
@@ -16,6 +16,7 @@ DATA_DIR = "docs"
 GUILD_DATA_FILE = os.path.join(DATA_DIR, "guild-data.json")
 BASELINE_FILE = os.path.join(DATA_DIR, "daily-baseline.json")
 HISTORICAL_FILE = os.path.join(DATA_DIR, "historical-data.json")
+CURRENCY_TIERS = ((1e12, "T"), (1e9, "B"), (1e6, "M"), (1e3, "K"))
 
 ITEM_MAPPING = {
     # Resources
@@ -68,13 +69,12 @@ class MockDataGenerator:
 
     def calculate_codex_cost(self, start_level: int, progress: int) -> int:
         if progress <= 0: return 0
-        return sum(range(start_level + 1, start_level + progress + 1))
+        return progress * (2 * start_level + progress + 1) // 2
 
     def format_currency(self, amount: float) -> str:
-        if amount >= 1e12: return f"{amount / 1e12:.2f}T"
-        if amount >= 1e9: return f"{amount / 1e9:.2f}B"
-        if amount >= 1e6: return f"{amount / 1e6:.2f}M"
-        if amount >= 1e3: return f"{amount / 1e3:.2f}K"
+        for threshold, suffix in CURRENCY_TIERS:
+            if amount >= threshold:
+                return f"{amount / threshold:.2f}{suffix}"
         return f"{amount:.2f}"
 
     def generate_guild_data(self) -> List[Dict]:
@@ -221,9 +221,9 @@ class MockDataGenerator:
         # Generate historical data (72 hours of data points)
         historical_data = self.generate_historical_data(current_guilds, 72)
         
-        # Save historical data first
+        # Save historical data first (compact: only read back by docs/migrate.py)
         with open(HISTORICAL_FILE, 'w') as f:
-            json.dump(historical_data, f, indent=2)
+            json.dump(historical_data, f, separators=(',', ':'))
         print("Generated historical data for charts")
         
         # Generate baseline
@@ -0,0 +1,48 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "guild-stats.py")
+spec = importlib.util.spec_from_file_location("guild_stats", SCRIPT)
+guild_stats = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(guild_stats)
+
+
+class UpdateGuildMetadataTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tracker = guild_stats.GuildStatsTracker(os.path.join(self.tmp.name, "guild-stats.db"))
+        self.tracker.db.connect()
+
+    def tearDown(self):
+        self.tracker.db.disconnect()
+        self.tmp.cleanup()
+
+    def guilds(self):
+        return dict(self.tracker.db.conn.execute("SELECT guild_id, guild_name FROM guilds ORDER BY guild_id"))
+
+    def update(self, *guilds):
+        with self.tracker.db.conn:
+            self.tracker.update_guild_metadata(
+                [{"GuildID": guild_id, "GuildName": name} for guild_id, name in guilds], "2025-01-01T00:00:00"
+            )
+
+    def test_renamed_guild_name_taken_by_another_guild(self):
+        self.update((0, "Alpha"), (1, "Beta"))
+        self.update((0, "Gamma"), (1, "Alpha"))
+        self.assertEqual(self.guilds(), {0: "Gamma", 1: "Alpha"})
+
+    def test_guilds_swap_names(self):
+        self.update((0, "Alpha"), (1, "Beta"))
+        self.update((0, "Beta"), (1, "Alpha"))
+        self.assertEqual(self.guilds(), {0: "Beta", 1: "Alpha"})
+
+    def test_old_owner_of_a_taken_name_is_dropped(self):
+        self.update((0, "Alpha"), (1, "Beta"))
+        self.update((1, "Alpha"))
+        self.assertEqual(self.guilds(), {1: "Alpha"})
+
+
+if __name__ == "__main__":
+    unittest.main()